@@ -4,17 +4,49 @@ blob.py
 This module provides functions to interact with Azure Blob Storage, including listing files, downloading files, and moving files within Blob Storage.
 
 Functions:
-    - get_blob_service_client() -> BlobServiceClient: Creates and returns a BlobServiceClient.
-    - list_files_in_blob_storage(container_name: str) -> List[str]: Lists all files in a specified container.
-    - download_file_from_blob_storage(container_name: str, blob_name: str, download_path: str) -> None: Downloads a file from a specified container.
-    - archive_in_blob(container_name: str, src_blob_name: str, dest_blob_name: str) -> None: Moves a file within Azure Blob Storage.
+    - get_blob_service_client() -> BlobServiceClient: Creates and returns a shared BlobServiceClient.
+    - get_container_client(container_name: str) -> ContainerClient: Returns a shared ContainerClient for a container.
+    - get_blob_client(container_name: str, blob_name: str) -> BlobClient: Returns a shared BlobClient for a blob.
+    - list_files_in_blob_storage(container_name: str, prefix: Optional[str] = None) -> List[str]: Lists all files in a specified container.
+    - list_blobs_with_last_modified(container_name: str, prefix: Optional[str] = None) -> List[Tuple[str, datetime]]: Lists all files in a specified container with their last modified times.
+    - download_file_from_blob_storage(container_name: str, blob_name: str, download_path: str, max_concurrency: int = DOWNLOAD_MAX_CONCURRENCY) -> None: Downloads a file from a specified container.
+    - download_blob_to_bytes(container_name: str, blob_name: str, max_concurrency: int = DOWNLOAD_MAX_CONCURRENCY) -> bytes: Downloads a file from a specified container into memory.
+    - archive_in_blob(container_name: str, src_blob_name: str, dest_blob_name: str, delete_source: bool = True) -> None: Moves a file within Azure Blob Storage.
+    - delete_blobs(container_name: str, blob_names: List[str]) -> None: Deletes blobs using batch requests.
 """
 
 import os
-from typing import List
-from azure.storage.blob import BlobServiceClient
-
-
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import (
+    BlobBlock,
+    BlobClient,
+    BlobServiceClient,
+    ContainerClient,
+    generate_blob_sas,
+)
+from exc import BlobStorageError  # pylint: disable=import-error
+from utils import (  # pylint: disable=import-error
+    COPY_MAX_CONCURRENCY,
+    DOWNLOAD_MAX_CONCURRENCY,
+    URL_COPY_CHUNK_SIZE,
+    URL_COPY_THRESHOLD,
+    is_same_content,
+    make_read_sas_url,
+    make_storage_transport,
+)
+
+# Range size used for downloads, larger than the SDK default to cut round trips
+DOWNLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Maximum number of sub-requests the service accepts in one blob batch
+BATCH_SIZE = 256
+
+
+@lru_cache(maxsize=1)
 def get_blob_service_client() -> BlobServiceClient:
     """
     Creates a BlobServiceClient to interact with the Azure Blob Storage service.
@@ -27,25 +59,83 @@ def get_blob_service_client() -> BlobServiceClient:
     blob_service_client = BlobServiceClient(
         account_url=f"https://{account_name}.blob.core.windows.net",
         credential=account_key,
+        max_single_get_size=DOWNLOAD_CHUNK_SIZE,
+        max_chunk_get_size=DOWNLOAD_CHUNK_SIZE,
+        transport=make_storage_transport(),
     )
     return blob_service_client
 
 
-def list_files_in_blob_storage(container_name: str) -> List[str]:
+@lru_cache(maxsize=None)
+def get_container_client(container_name: str) -> ContainerClient:
+    """
+    Returns a cached ContainerClient for the specified container.
+
+    Parameters:
+    - container_name: Name of the container
+
+    Returns:
+    - ContainerClient: Client bound to the shared BlobServiceClient
+    """
+    return get_blob_service_client().get_container_client(container_name)
+
+
+@lru_cache(maxsize=256)
+def get_blob_client(container_name: str, blob_name: str) -> BlobClient:
+    """
+    Returns a cached BlobClient for the specified blob.
+
+    Parameters:
+    - container_name: Name of the container containing the blob
+    - blob_name: Name of the blob
+
+    Returns:
+    - BlobClient: Client bound to the shared ContainerClient
+    """
+    return get_container_client(container_name).get_blob_client(blob_name)
+
+
+def list_files_in_blob_storage(
+    container_name: str, prefix: Optional[str] = None
+) -> List[str]:
     """
     Lists all files (blobs) inside a specified container in Azure Blob Storage.
 
     Parameters:
     - container_name: Name of the container to list files from
+    - prefix: Only list blobs whose names start with this prefix; filtered server-side
 
     Returns:
     - List[str]: List of filenames sorted by last modified date from oldest to newest
     """
 
-    blob_service_client = get_blob_service_client()
-    container_client = blob_service_client.get_container_client(container_name)
+    return [
+        blob_name
+        for blob_name, _ in list_blobs_with_last_modified(container_name, prefix)
+    ]
 
-    blob_list = container_client.list_blobs()
+
+def list_blobs_with_last_modified(
+    container_name: str, prefix: Optional[str] = None
+) -> List[Tuple[str, datetime]]:
+    """
+    Lists all files (blobs) inside a specified container together with their last modified times.
+
+    Parameters:
+    - container_name: Name of the container to list files from
+    - prefix: Only list blobs whose names start with this prefix; filtered server-side
+
+    Returns:
+    - List[Tuple[str, datetime]]: Pairs of filename and timezone-aware last modified time,
+      sorted from oldest to newest
+    """
+
+    container_client = get_container_client(container_name)
+
+    # Each page of the listing already carries last_modified; use the largest page size
+    blob_list = container_client.list_blobs(
+        name_starts_with=prefix, results_per_page=5000
+    )
 
     files_in_container = []
     for blob in blob_list:
@@ -54,14 +144,14 @@ def list_files_in_blob_storage(container_name: str) -> List[str]:
     # Sort files by last modified date from oldest to newest
     files_in_container.sort(key=lambda x: x[1])
 
-    # Extract only the filenames, discarding the last modified date
-    sorted_files = [file[0] for file in files_in_container]
-
-    return sorted_files
+    return files_in_container
 
 
 def download_file_from_blob_storage(
-    container_name: str, blob_name: str, download_path: str
+    container_name: str,
+    blob_name: str,
+    download_path: str,
+    max_concurrency: int = DOWNLOAD_MAX_CONCURRENCY,
 ) -> None:
     """
     Downloads a file (blob) from a specified container in Azure Blob Storage.
@@ -70,25 +160,103 @@ def download_file_from_blob_storage(
     - container_name: Name of the container containing the blob
     - blob_name: Name of the blob (file) to download
     - download_path: Local path where the file should be downloaded to
+    - max_concurrency: Number of parallel range requests used for the download
     """
 
-    blob_service_client = get_blob_service_client()
-
-    # Get the container client
-    container_client = blob_service_client.get_container_client(container_name)
-
     # Get the blob client for the specified blob
-    blob_client = container_client.get_blob_client(blob_name)
+    blob_client = get_blob_client(container_name, blob_name)
 
-    # Download the blob to a local file
+    # Download the blob to a local file, streaming parallel ranges straight to disk
+    stream = blob_client.download_blob(max_concurrency=max_concurrency)
     with open(download_path, "wb") as download_file:
-        download_file.write(blob_client.download_blob().readall())
+        stream.readinto(download_file)
 
     print(f"File '{blob_name}' downloaded successfully to '{download_path}'")
 
 
+def download_blob_to_bytes(
+    container_name: str,
+    blob_name: str,
+    max_concurrency: int = DOWNLOAD_MAX_CONCURRENCY,
+) -> bytes:
+    """
+    Downloads a file (blob) from a specified container in Azure Blob Storage into memory.
+
+    Parameters:
+    - container_name: Name of the container containing the blob
+    - blob_name: Name of the blob (file) to download
+    - max_concurrency: Number of parallel range requests used for the download
+
+    Returns:
+    - bytes: Content of the blob
+    """
+
+    blob_client = get_blob_client(container_name, blob_name)
+    content = blob_client.download_blob(max_concurrency=max_concurrency).readall()
+
+    print(f"File '{blob_name}' downloaded successfully into memory")
+    return content
+
+
+def _get_source_url(blob_client: BlobClient) -> str:
+    """
+    Builds a short-lived read SAS URL for a blob, as required by the *From URL copy operations.
+
+    Parameters:
+    - blob_client: Client for the source blob
+
+    Returns:
+    - str: URL of the blob including a read-only SAS token
+    """
+    return make_read_sas_url(
+        blob_client.url,
+        generate_blob_sas,
+        account_name=blob_client.account_name,
+        container_name=blob_client.container_name,
+        blob_name=blob_client.blob_name,
+        account_key=os.environ["BLOB_KEY"],
+    )
+
+
+def _copy_blob_in_blocks(
+    src_blob_client: BlobClient, dest_blob_client: BlobClient, size: int
+) -> None:
+    """
+    Copies a blob synchronously by staging its ranges as blocks from URL in parallel
+    and committing the block list once every block has been staged.
+
+    Parameters:
+    - src_blob_client: Client for the source blob
+    - dest_blob_client: Client for the destination blob
+    - size: Size of the source blob in bytes
+    """
+    source_url = _get_source_url(src_blob_client)
+    offsets = list(range(0, size, URL_COPY_CHUNK_SIZE))
+    # Block IDs must all have the same length within a blob
+    block_ids = [f"{index:08d}" for index in range(len(offsets))]
+
+    def stage_block(index: int) -> None:
+        offset = offsets[index]
+        dest_blob_client.stage_block_from_url(
+            block_id=block_ids[index],
+            source_url=source_url,
+            source_offset=offset,
+            source_length=min(URL_COPY_CHUNK_SIZE, size - offset),
+        )
+
+    with ThreadPoolExecutor(max_workers=COPY_MAX_CONCURRENCY) as executor:
+        list(executor.map(stage_block, range(len(offsets))))
+
+    dest_blob_client.commit_block_list(
+        [BlobBlock(block_id=block_id) for block_id in block_ids]
+    )
+
+
 def archive_in_blob(
-    container_name: str, src_blob_name: str, dest_blob_name: str
+    container_name: str,
+    src_blob_name: str,
+    dest_blob_name: str,
+    delete_source: bool = True,
 ) -> None:
     """
     Moves a file (blob) from one location to another within Azure Blob Storage.
@@ -98,31 +266,66 @@ def archive_in_blob(
     - src_blob_name: Name of the source blob (file)
     - dest_container_name: Name of the destination container
     - dest_blob_name: Name of the destination blob (file)
+    - delete_source: Delete the source once copied; pass False to remove sources
+      later in bulk with delete_blobs
     """
 
-    blob_service_client = get_blob_service_client()
-
-    # Get the source and destination container clients
-    container_client = blob_service_client.get_container_client(container_name)
-
     # Get the blob client for the source blob
-    src_blob_client = container_client.get_blob_client(src_blob_name)
+    src_blob_client = get_blob_client(container_name, src_blob_name)
 
     # Get the blob client for the destination blob
-    dest_blob_client = container_client.get_blob_client(dest_blob_name)
+    dest_blob_client = get_blob_client(container_name, dest_blob_name)
 
-    # Copy the source blob to the destination
-    copy_source = src_blob_client.url
-    dest_blob_client.start_copy_from_url(copy_source)
+    src_properties = src_blob_client.get_blob_properties()
+    try:
+        dest_properties = dest_blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        dest_properties = None
 
-    # Wait for the copy operation to complete
-    copy_status = dest_blob_client.get_blob_properties().copy.status
-    while copy_status == "pending":
-        copy_status = dest_blob_client.get_blob_properties().copy.status
+    if is_same_content(src_properties, dest_properties):
+        if delete_source:
+            src_blob_client.delete_blob()
+        print(f"File '{src_blob_name}' was already archived")
+        return
 
-    # Delete the source blob
-    src_blob_client.delete_blob()
+    # Copy the source blob to the destination
+    size = src_properties.size
+    if size > URL_COPY_THRESHOLD:
+        _copy_blob_in_blocks(src_blob_client, dest_blob_client, size)
+    else:
+        # A synchronous copy completes before returning, so there is nothing to poll
+        copy_source = _get_source_url(src_blob_client)
+        copy = dest_blob_client.start_copy_from_url(copy_source, requires_sync=True)
+        if copy["copy_status"] != "success":
+            raise BlobStorageError(f"{src_blob_name} archiving failed")
+
+    # Delete the source blob only once the destination is complete
+    if delete_source:
+        src_blob_client.delete_blob()
 
     print(
         f"File '{src_blob_name}' moved successfully to '{container_name}/{dest_blob_name}'"
     )
+
+
+def delete_blobs(container_name: str, blob_names: List[str]) -> None:
+    """
+    Deletes blobs from a container, sending up to BATCH_SIZE deletions per batch request.
+
+    Any deletion that fails inside a batch (other than the blob already being gone)
+    is retried as an individual call, which raises if it fails again.
+
+    Parameters:
+    - container_name: Name of the container containing the blobs
+    - blob_names: Names of the blobs to delete
+    """
+
+    container_client = get_container_client(container_name)
+    for start in range(0, len(blob_names), BATCH_SIZE):
+        batch = blob_names[start : start + BATCH_SIZE]
+        responses = container_client.delete_blobs(*batch, raise_on_any_failure=False)
+        for blob_name, response in zip(batch, responses):
+            if response.status_code not in (202, 404):
+                get_blob_client(container_name, blob_name).delete_blob()
+
+    print(f"Deleted {len(blob_names)} file(s) from '{container_name}'")
@@ -7,5 +7,9 @@ class FileShareError(Exception):
     pass
 
 
+class BlobStorageError(Exception):
+    pass
+
+
 class DataFileError(Exception):
     pass
@@ -4,18 +4,40 @@ fileshare.py
 This module provides functions to interact with Azure File Share, including listing files, downloading files, and moving files within the file share.
 
 Functions:
-    - get_fileshare_service_client() -> ShareServiceClient: Creates and returns a ShareServiceClient.
+    - get_fileshare_service_client() -> ShareServiceClient: Creates and returns a shared ShareServiceClient.
+    - get_share_client(fileshare_name: str) -> ShareClient: Returns a shared ShareClient for a file share.
     - list_files_in_fileshare(fileshare_name: str, directory_path: str = "") -> List[str]: Lists all files in a specified directory.
-    - download_from_fileshare(local_file_path: str, fileshare_name: str, fileshare_path: str) -> None: Downloads a file from a specified path.
+    - list_tree_in_fileshare(fileshare_name: str, directory_path: str, subdirectories: Tuple[str, ...] = ()) -> Dict[str, List[str]]: Lists a directory and some of its subdirectories concurrently.
+    - download_from_fileshare(local_file_path: str, fileshare_name: str, fileshare_path: str, max_concurrency: int = DOWNLOAD_MAX_CONCURRENCY) -> str: Downloads a file from a specified path and returns its content hash.
     - archive_in_fileshare(fileshare_name: str, source_path: str, destination_path: str) -> None: Moves a file within Azure File Share.
 """
 
 import os
-from typing import List
-from azure.storage.fileshare import ShareServiceClient
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Tuple
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.fileshare import (
+    ShareClient,
+    ShareFileClient,
+    ShareServiceClient,
+    generate_file_sas,
+)
 from exc import FileShareError
-
-
+from utils import (  # pylint: disable=import-error
+    COPY_MAX_CONCURRENCY,
+    DOWNLOAD_MAX_CONCURRENCY,
+    URL_COPY_CHUNK_SIZE,
+    URL_COPY_THRESHOLD,
+    is_same_content,
+    hash_file,
+    make_read_sas_url,
+    make_storage_transport,
+    wait_for_copy,
+)
+
+
+@lru_cache(maxsize=1)
 def get_fileshare_service_client() -> ShareServiceClient:
     """
     Creates a ShareServiceClient to interact with the Azure File Share service.
@@ -28,10 +50,25 @@ def get_fileshare_service_client() -> ShareServiceClient:
     service_client = ShareServiceClient(
         account_url=f"https://{account_name}.file.core.windows.net",
         credential=account_key,
+        transport=make_storage_transport(),
     )
     return service_client
 
 
+@lru_cache(maxsize=None)
+def get_share_client(fileshare_name: str) -> ShareClient:
+    """
+    Returns a cached ShareClient for the specified file share.
+
+    Args:
+        fileshare_name (str): The name of the Azure File Share.
+
+    Returns:
+        ShareClient: Client bound to the shared ShareServiceClient.
+    """
+    return get_fileshare_service_client().get_share_client(fileshare_name)
+
+
 def list_files_in_fileshare(fileshare_name: str, directory_path: str = "") -> List[str]:
     """
     Lists all files in a specified directory of an Azure File Share.
@@ -43,19 +80,16 @@ def list_files_in_fileshare(fileshare_name: str, directory_path: str = "") -> Li
     Returns:
         List[str]: A list of file names in the specified directory of the Azure File Share.
     """
-    service_client = get_fileshare_service_client()
-    share_client = service_client.get_share_client(fileshare_name)
+    share_client = get_share_client(fileshare_name)
     directory_client = share_client.get_directory_client(directory_path)
-    file_list = directory_client.list_directories_and_files()
+    # Request timestamps inline so the listing does not need a properties call per file
+    file_list = directory_client.list_directories_and_files(include=["timestamps"])
 
     files_in_directory = []
     for file_or_dir in file_list:
         if not file_or_dir["is_directory"]:
-            file_properties = directory_client.get_file_client(
-                file_or_dir["name"]
-            ).get_file_properties()
             files_in_directory.append(
-                (file_or_dir["name"], file_properties["last_modified"])
+                (file_or_dir["name"], file_or_dir["last_modified"])
             )
 
     # Sort files by last modified date from oldest to newest
@@ -67,27 +101,97 @@ def list_files_in_fileshare(fileshare_name: str, directory_path: str = "") -> Li
     return sorted_files
 
 
+def list_tree_in_fileshare(
+    fileshare_name: str, directory_path: str, subdirectories: Tuple[str, ...] = ()
+) -> Dict[str, List[str]]:
+    """
+    Lists the files in a directory and in the given subdirectories with one concurrent pass.
+
+    The SDK has no recursive listing, so each directory is still one listing call,
+    but they run in parallel rather than one after another.
+
+    Args:
+        fileshare_name (str): The name of the Azure File Share.
+        directory_path (str): The path of the root directory within the file share.
+        subdirectories (Tuple[str, ...], optional): Subdirectories of the root to list as well.
+
+    Returns:
+        Dict[str, List[str]]: File names sorted by last modified date, keyed by directory path.
+    """
+    paths = [directory_path] + [
+        f"{directory_path}/{subdirectory}" for subdirectory in subdirectories
+    ]
+    with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+        listings = executor.map(
+            lambda path: list_files_in_fileshare(fileshare_name, path), paths
+        )
+        return dict(zip(paths, listings))
+
+
 def download_from_fileshare(
-    local_file_path: str, fileshare_name: str, fileshare_path: str
-) -> None:
+    local_file_path: str,
+    fileshare_name: str,
+    fileshare_path: str,
+    max_concurrency: int = DOWNLOAD_MAX_CONCURRENCY,
+) -> str:
     """
-    Downloads a file from a specified path in an Azure File Share to a local path.
+    Downloads a file from a specified path in an Azure File Share to a local path
+    using parallel range requests, then hashes the downloaded content.
 
     Args:
         local_file_path (str): The local path where the file will be saved.
         fileshare_name (str): The name of the Azure File Share.
         fileshare_path (str): The path within the Azure File Share from where the file will be downloaded.
+        max_concurrency (int, optional): Number of parallel range requests used for the download.
 
     Returns:
-        None
+        str: Hex digest of the downloaded content.
     """
-    service_client = get_fileshare_service_client()
-    file_client = service_client.get_share_client(fileshare_name).get_file_client(
-        fileshare_path
-    )
+    file_client = get_share_client(fileshare_name).get_file_client(fileshare_path)
     with open(local_file_path, "wb") as target_file:
-        data = file_client.download_file()
+        data = file_client.download_file(max_concurrency=max_concurrency)
         data.readinto(target_file)
+    # Parallel ranges arrive out of order, so hash the completed file instead
+    return hash_file(local_file_path)
+
+
+def _copy_file_in_ranges(
+    source_file_client: ShareFileClient,
+    destination_file_client: ShareFileClient,
+    size: int,
+) -> None:
+    """
+    Copies a file synchronously by creating the destination and filling its ranges
+    from the source URL in parallel.
+
+    Args:
+        source_file_client (ShareFileClient): Client for the source file.
+        destination_file_client (ShareFileClient): Client for the destination file.
+        size (int): Size of the source file in bytes.
+
+    Returns:
+        None
+    """
+    source_url = make_read_sas_url(
+        source_file_client.url,
+        generate_file_sas,
+        account_name=source_file_client.account_name,
+        share_name=source_file_client.share_name,
+        file_path=source_file_client.file_path,
+        account_key=os.environ["FILESHARE_KEY"],
+    )
+    destination_file_client.create_file(size)
+
+    def copy_range(offset: int) -> None:
+        destination_file_client.upload_range_from_url(
+            source_url,
+            offset=offset,
+            length=min(URL_COPY_CHUNK_SIZE, size - offset),
+            source_offset=offset,
+        )
+
+    with ThreadPoolExecutor(max_workers=COPY_MAX_CONCURRENCY) as executor:
+        list(executor.map(copy_range, range(0, size, URL_COPY_CHUNK_SIZE)))
 
 
 def archive_in_fileshare(
@@ -104,28 +208,44 @@ def archive_in_fileshare(
     Returns:
         None
     """
-    service_client = get_fileshare_service_client()
-    share_client = service_client.get_share_client(fileshare_name)
+    share_client = get_share_client(fileshare_name)
     source_file_client = share_client.get_file_client(source_path)
 
     # Extract the file name from the source path
     file_name = os.path.basename(source_path)
-    print("Archiving {source_path} to {destination_path}")
+    print(f"Archiving {source_path} to {destination_path}")
     # Create a new file client for the destination
     destination_file_client = share_client.get_file_client(
         os.path.join(destination_path, file_name)
     )
 
-    _ = destination_file_client.start_copy_from_url(source_file_client.url)
-
-    # Wait for the copy to complete
-    properties = destination_file_client.get_file_properties()
-    while properties["copy"]["status"] == "pending":
-        properties = destination_file_client.get_file_properties()
+    source_properties = source_file_client.get_file_properties()
+    try:
+        destination_properties = destination_file_client.get_file_properties()
+    except ResourceNotFoundError:
+        destination_properties = None
+
+    if is_same_content(source_properties, destination_properties):
+        source_file_client.delete_file()
+        return
+
+    size = source_properties["size"]
+    if size > URL_COPY_THRESHOLD:
+        _copy_file_in_ranges(source_file_client, destination_file_client, size)
+    else:
+        copy = destination_file_client.start_copy_from_url(source_file_client.url)
+
+        # A copy within the same share usually completes during the request,
+        # so only poll when the service reports it is still pending
+        copy_status = copy["copy_status"]
+        if copy_status == "pending":
+            copy_status = wait_for_copy(
+                lambda: destination_file_client.get_file_properties()["copy"]["status"]
+            )
 
-    # Ensure the copy succeeded
-    if properties["copy"]["status"] != "success":
-        raise FileShareError(f"{source_path} archiving failed")
+        # Ensure the copy succeeded
+        if copy_status != "success":
+            raise FileShareError(f"{source_path} archiving failed")
 
     # If copy was successful, delete the original file
     source_file_client.delete_file()
@@ -3,330 +3,555 @@ main.py
 
 This module orchestrates the process of listing, downloading, processing, and archiving files from Azure Blob Storage and Azure File Share. It also logs the processed files and merges the data into an SQL database.
 
+Each source is described by a PipelineSpec and all of them are run by the same loop, run_pipeline.
+
 Functions:
-    - list_files_in_blob_storage(container_name: str) -> List[str]: Lists files in the specified Azure Blob Storage container.
-    - download_file_from_blob_storage(container_name: str, blob_name: str, download_path: str) -> None: Downloads a specified file from Azure Blob Storage.
-    - archive_in_blob(container_name: str, src_blob_name: str, dest_blob_name: str) -> None: Moves a file within Azure Blob Storage.
-    - list_files_in_fileshare(fileshare_name: str, directory_path: str = "") -> List[str]: Lists files in the specified Azure File Share directory.
-    - download_from_fileshare(local_file_path: str, fileshare_name: str, fileshare_path: str) -> None: Downloads a specified file from Azure File Share.
+    - list_blobs_with_last_modified(container_name: str, prefix: Optional[str] = None) -> List[Tuple[str, datetime]]: Lists files in the specified Azure Blob Storage container with their last modified times.
+    - download_blob_to_bytes(container_name: str, blob_name: str, max_concurrency: int = DOWNLOAD_MAX_CONCURRENCY) -> bytes: Downloads a specified file from Azure Blob Storage into memory.
+    - archive_in_blob(container_name: str, src_blob_name: str, dest_blob_name: str, delete_source: bool = True) -> None: Moves a file within Azure Blob Storage.
+    - delete_blobs(container_name: str, blob_names: List[str]) -> None: Deletes blobs from Azure Blob Storage using batch requests.
+    - list_tree_in_fileshare(fileshare_name: str, directory_path: str, subdirectories: Tuple[str, ...] = ()) -> Dict[str, List[str]]: Lists an Azure File Share directory and some of its subdirectories.
+    - download_from_fileshare(local_file_path: str, fileshare_name: str, fileshare_path: str, max_concurrency: int = DOWNLOAD_MAX_CONCURRENCY) -> str: Downloads a specified file from Azure File Share and returns its content hash.
     - archive_in_fileshare(fileshare_name: str, source_path: str, destination_path: str) -> None: Moves a file within Azure File Share.
-    - make_dir(directory_path: str) -> None: Creates a directory if it doesn't already exist.
-    - generate_id(length: int = 8) -> str: Generates a random ID of the specified length.
-    - filter_files(files: List[str]) -> List[str]: Filters a list of filenames, returning only those that end with .csv, .xls, or .xlsx.
-    - process_file(file_path: str) -> pd.DataFrame: Processes the specified file and returns its data as a DataFrame.
-    - connection() -> sqlalchemy.engine.base.Connection: Provides a connection to the SQL database.
+    - make_temp_dir() -> str: Creates a temporary download directory that is removed at exit.
+    - filter_files(files: List[str], exclude: Optional[str] = None) -> List[str]: Filters a list of filenames, returning only those that end with .csv, .xls, or .xlsx.
+    - hash_content(content: bytes) -> str: Returns the hex digest of a file's content.
+    - prefetch(executor: Executor, func: Callable[[T], R], items: List[T], window: int, release: Optional[Callable[[R], None]] = None) -> Generator[Tuple[T, R], None, None]: Runs transfers a bounded number of files ahead of processing.
+    - process_file_from_buffer(buffer: BinaryIO, file_name: str) -> pd.DataFrame: Processes in-memory file content, parsing any Period column, and returns its data as a DataFrame.
+    - load_staging(data: pd.DataFrame, name: str, schema: str = "staging", chunksize: int = 10000, dtype: Optional[Mapping[str, TypeEngine]] = None) -> None: Replaces the contents of a staging table with a DataFrame.
     - merge_data(source: str, target: str) -> None: Merges data from the source table to the target table in the SQL database.
-    - log_file(file_name: str, source: str) -> None: Logs a processed file entry into the SQL database.
+    - merge_elective_recovery_data(source: str, target: str) -> None: Merges elective recovery data from the source table to the target table.
+    - execute_queries(queries: List[Tuple[str, Optional[QueryParams]]]) -> None: Executes several SQL commands in one transaction.
+    - log_files(file_names: List[str], source: str) -> None: Logs several processed file entries in one transaction.
+    - get_logged_files(source: str) -> Dict[str, datetime]: Returns when each file of a source was last logged.
+    - list_blob_uploads() -> List[str]: Lists the new files in the qvh blob container.
+    - list_fileshare_uploads() -> Dict[str, List[str]]: Lists the qvh file share upload directories once per run.
+    - fetch_from_blob(blob_name: str) -> Tuple[str, BinaryIO]: Downloads a blob into memory.
+    - fetch_from_fileshare(fileshare_path: str, local_dir: str) -> Tuple[str, BinaryIO]: Downloads a file from Azure File Share.
+    - close_fetched(fetched: Tuple[str, BinaryIO]) -> None: Closes the buffer of a fetched file that was never processed.
+    - archive_blobs(blob_names: List[str]) -> None: Archives processed blobs and deletes the sources in batches.
+    - archive_fileshare_files(fileshare_paths: List[str]) -> None: Archives processed file share files.
+    - prepare_generic_metrics(data: pd.DataFrame) -> Optional[pd.DataFrame]: Validates and normalises a generic metrics file.
+    - combine_generic_metrics(data: pd.DataFrame) -> pd.DataFrame: Keeps the newest row with a Numerator per generic metric key.
+    - combine_elective_recovery(data: pd.DataFrame) -> pd.DataFrame: Keeps the newest non-null values per elective recovery key.
+    - load_generic_metrics(data: pd.DataFrame) -> None: Stages a run's generic metrics and merges them into scd.Metric.
+    - load_elective_recovery(data: pd.DataFrame) -> None: Stages a run's elective recovery data and merges it.
+    - load_and_merge(spec: PipelineSpec, frames: List[pd.DataFrame]) -> None: Stages a run's files and merges them once.
+    - run_pipeline(spec: PipelineSpec, executor: Executor) -> bool: Processes every new file of one source.
 
 Execution:
     - Lists and processes new files from Azure Blob Storage and Azure File Share.
-    - Downloads and archives the files.
-    - Processes the data and merges it into the SQL database.
+    - Downloads the files on background threads while earlier files are processed.
+    - Processes the data and merges each source's files into the SQL database with a single merge.
+    - Archives the files only once their data has been merged.
     - Logs the processed files.
 """
+import io
 import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import BinaryIO, Callable, Dict, List, Literal, Optional, Tuple
 import pandas as pd
+from sqlalchemy.types import Float
 from blob import (
-    list_files_in_blob_storage,
-    download_file_from_blob_storage,
+    list_blobs_with_last_modified,
+    download_blob_to_bytes,
     archive_in_blob,
+    delete_blobs,
 )
 from fileshare import (
-    list_files_in_fileshare,
+    list_tree_in_fileshare,
     download_from_fileshare,
     archive_in_fileshare,
 )
-from sql import connection, merge_data, log_file,execute_query
-from utils import make_dir, generate_id, filter_files, process_file
+from sql import (
+    load_staging,
+    merge_data,
+    merge_elective_recovery_data,
+    log_files,
+    execute_queries,
+    get_logged_files,
+)
+from utils import (
+    MAX_TRANSFER_WORKERS,
+    make_temp_dir,
+    filter_files,
+    hash_content,
+    prefetch,
+    process_file_from_buffer,
+)
 
+# Number of files fetched ahead of the one being processed
+PREFETCH_WINDOW = 2 * MAX_TRANSFER_WORKERS
 
-if __name__ == "__main__":
-    data_changed=False
-    client_id = os.environ["AZURE_CLIENT_ID"]
-    client_secret = os.environ["AZURE_CLIENT_SECRET"]
-    tenant_id = os.environ["AZURE_TENANT_ID"]
-    files = list_files_in_blob_storage(container_name="qvh")
-    files = [file for file in files if "Processed" not in file]
-    files = filter_files(files)
-    print(files)
-    if files != []:
-        previous_data = None
-        run_id = generate_id()
-        make_dir(run_id)
-        for file in files:
-            file_name = file.split("/")[-1]
-            download_file_from_blob_storage(
+GENERIC_METRIC_COLUMNS = [
+    "Metric Name",
+    "Period",
+    "Specialty/Trust",
+    "Numerator",
+    "Denominator",
+    "SourceFile",
+]
+GENERIC_MERGE_KEYS = ("Metric Name", "Period", "Specialty/Trust")
+# Staged as FLOAT whatever the file holds, so an integer-only file cannot create
+# BIGINT columns that a later file's decimals would not fit
+GENERIC_STAGING_DTYPES = {"Numerator": Float(), "Denominator": Float()}
+ELECTIVE_RECOVERY_STAGING_DTYPES = {"Plan": Float(), "Activity": Float(), "Variance": Float()}
+ELECTIVE_RECOVERY_MERGE_KEYS = (
+    "ElectiveRecoveryGroup",
+    "ReportingPODDescription",
+    "OPS",
+    "SpecialtyDescription",
+    "OnSite",
+    "Month",
+)
+
+
+@dataclass(frozen=True)
+class PipelineSpec:
+    """
+    Describes one source of metric files and how its data is loaded.
+
+    Attributes:
+        name (str): Name of the source, used in progress messages.
+        source (str): Source recorded against each file in the file log.
+        list_files (Callable[[], List[str]]): Returns the files to process, oldest first.
+        fetch (Callable[[str], Tuple[str, BinaryIO]]): Downloads a file, returning its content hash and a readable buffer.
+        load (Callable[[pd.DataFrame], None]): Stages the concatenated files of a run and merges them into their target.
+        prepare (Callable[[pd.DataFrame], Optional[pd.DataFrame]], optional): Normalises a parsed file, or returns None to skip it.
+        archive (Callable[[List[str]], None], optional): Archives the files whose data was merged, once the merge has succeeded.
+    """
+
+    name: str
+    source: Literal["SFTP", "FileShare"]
+    list_files: Callable[[], List[str]]
+    fetch: Callable[[str], Tuple[str, BinaryIO]]
+    load: Callable[[pd.DataFrame], None]
+    prepare: Optional[Callable[[pd.DataFrame], Optional[pd.DataFrame]]] = None
+    archive: Optional[Callable[[List[str]], None]] = None
+
+
+def list_blob_uploads() -> List[str]:
+    """
+    Lists the new data files in the qvh blob container, oldest first.
+
+    Archived blobs are left out, as are blobs recorded in the file log since they
+    were last uploaded; a blob re-uploaded under a name that was processed before
+    is picked up again. BLOB_UPLOAD_PREFIX scopes the listing to the upload
+    drop-zone so archived blobs are not paged through; when unset the whole
+    container is listed.
+
+    Returns:
+        List[str]: Names of the blobs to process.
+    """
+    logged = get_logged_files(source="SFTP")
+    last_modified = dict(
+        list_blobs_with_last_modified(
+            container_name="qvh", prefix=os.environ.get("BLOB_UPLOAD_PREFIX")
+        )
+    )
+    files = []
+    skipped = []
+    for file in filter_files(list(last_modified), exclude="Processed"):
+        logged_at = logged.get(file.split("/")[-1])
+        if logged_at is not None and logged_at >= last_modified[file]:
+            skipped.append(file)
+        else:
+            files.append(file)
+    if skipped:
+        print(f"Skipping files already logged since their last upload: {skipped}")
+    return files
+
+
+@lru_cache(maxsize=1)
+def list_fileshare_uploads() -> Dict[str, List[str]]:
+    """
+    Lists both qvh file share upload directories in one concurrent pass, once per run.
+
+    Returns:
+        Dict[str, List[str]]: Paths of the data files in each upload directory, oldest first, keyed by directory path.
+    """
+    listings = list_tree_in_fileshare(
+        fileshare_name="qvh",
+        directory_path="Uploads/IQPR",
+        subdirectories=("ElectiveRecovery",),
+    )
+    return {
+        path: [f"{path}/{file}" for file in filter_files(files=files)]
+        for path, files in listings.items()
+    }
+
+
+def fetch_from_blob(blob_name: str) -> Tuple[str, BinaryIO]:
+    """
+    Downloads a blob from the qvh container into memory.
+
+    Blobs are parsed straight from memory, skipping a write and re-read on disk.
+
+    Args:
+        blob_name (str): Name of the blob in the qvh container.
+
+    Returns:
+        Tuple[str, BinaryIO]: Hex digest of the content and a buffer holding it.
+    """
+    content = download_blob_to_bytes(container_name="qvh", blob_name=blob_name)
+    return hash_content(content), io.BytesIO(content)
+
+
+def fetch_from_fileshare(fileshare_path: str, local_dir: str) -> Tuple[str, BinaryIO]:
+    """
+    Downloads a file from the qvh file share.
+
+    The file is not archived here: it is only moved once its data has been merged,
+    so a failed run leaves it in place to be picked up again.
+
+    Args:
+        fileshare_path (str): Path of the file within the file share.
+        local_dir (str): Local directory the file is saved to.
+
+    Returns:
+        Tuple[str, BinaryIO]: Hex digest of the content and the downloaded file opened for reading;
+        the file is deleted from disk once this handle is closed.
+    """
+    local_file_path = os.path.join(local_dir, os.path.basename(fileshare_path))
+    content_hash = download_from_fileshare(
+        fileshare_name="qvh",
+        fileshare_path=fileshare_path,
+        local_file_path=local_file_path,
+    )
+    file = open(local_file_path, "rb")  # pylint: disable=consider-using-with
+    # Unlink straight away: the open handle keeps the content readable and its
+    # space is freed as soon as the file has been parsed and closed
+    os.remove(local_file_path)
+    return content_hash, file
+
+
+def close_fetched(fetched: Tuple[str, BinaryIO]) -> None:
+    """
+    Closes the buffer of a fetched file that was never processed.
+
+    Args:
+        fetched (Tuple[str, BinaryIO]): The content hash and buffer returned by a fetch.
+
+    Returns:
+        None
+    """
+    fetched[1].close()
+
+
+def archive_blobs(blob_names: List[str]) -> None:
+    """
+    Archives processed blobs in the qvh container.
+
+    The copies run concurrently and keep their sources; once every copy is done
+    the sources are deleted in batch requests.
+
+    Args:
+        blob_names (List[str]): Names of the blobs to archive.
+
+    Returns:
+        None
+    """
+    with ThreadPoolExecutor(max_workers=MAX_TRANSFER_WORKERS) as executor:
+        archives = [
+            executor.submit(
+                archive_in_blob,
                 container_name="qvh",
-                blob_name=file,
-                download_path=f"./{run_id}/{file_name}",
+                src_blob_name=blob_name,
+                dest_blob_name=f"home/IQPR/Processed/{blob_name.split('/')[-1]}",
+                delete_source=False,
             )
-            archive_path = f"home/IQPR/Processed/{file_name}"
-
-            data = process_file(f"./{run_id}/{file_name}")
-            
-            # data = data.reset_index(drop=False)
-            required_columns = {'Metric Name', 'Period', 'Specialty/Trust', 'Numerator', 'Denominator'}
-            if not required_columns.issubset(set(data.columns)):
-                print("Data does not match the headers, skipping")
-            else:
-                # data=data.drop("Denominator", axis=1)
-                data.columns = [
-                    "Metric Name",
-                    "Period",
-                    "Specialty/Trust",
-                    "Numerator",
-                    "Denominator",
-                    "SourceFile",
-                ]
-                data['Period'] = data['Period'].apply(lambda s: str(s).lstrip('01/'))
-                data['Period'] = pd.to_datetime(data['Period'])
-                data['Period'] = data['Period'].dt.strftime('%d-%m-%Y')
-
-                if previous_data is not None and previous_data.equals(data):
-                    print(
-                        f"File '{file_name}' is identical to the previous file. Skipping SQL write."
-                    )
-                else:
-                    with connection() as conn:
-                        assert "Metric Name" in data.columns, "Metric name col is missing"
-                        data.to_sql(
-                            name="Metrics_Generic",
-                            con=conn,
-                            schema="staging",
-                            if_exists="replace",
-                            index=False,
-                        )
-                        merge_data(source="staging.Metrics_Generic", target="scd.Metric")
-                        data_changed=True
-                        archive_in_blob(
-                container_name="qvh", src_blob_name=file, dest_blob_name=archive_path
-            )
-                        log_file(file_name=file_name, source="SFTP")
-                        previous_data = data
+            for blob_name in blob_names
+        ]
+        for archive in archives:
+            archive.result()
+    delete_blobs(container_name="qvh", blob_names=blob_names)
 
-    else:
-        print("No new files,skipping...")
 
-    files = list_files_in_fileshare(fileshare_name="qvh", directory_path="Uploads/IQPR")
-    files=filter_files(files=files)
-    print(files)
-    if files != []:
-        previous_data = None
-        run_id = generate_id()
-        make_dir(run_id)
-        for file in files:
-            print(f"Processing {file}")
-            file_name = file.split("/")[-1]
-            download_from_fileshare(
-                fileshare_name="qvh",
-                fileshare_path=f"Uploads/IQPR/{file}",
-                local_file_path=f"./{run_id}/{file_name}",
-            )
-            archive_in_fileshare(
+def archive_fileshare_files(fileshare_paths: List[str]) -> None:
+    """
+    Archives processed files in the qvh file share to Uploads/IQPR/Processed.
+
+    The moves run concurrently; the first one to fail is raised once all have finished.
+
+    Args:
+        fileshare_paths (List[str]): Paths of the files within the file share.
+
+    Returns:
+        None
+    """
+    with ThreadPoolExecutor(max_workers=MAX_TRANSFER_WORKERS) as executor:
+        archives = [
+            executor.submit(
+                archive_in_fileshare,
                 fileshare_name="qvh",
-                source_path=f"Uploads/IQPR/{file}",
-                destination_path=f"Uploads/IQPR/Processed",
+                source_path=fileshare_path,
+                destination_path="Uploads/IQPR/Processed",
             )
-            data = process_file(f"./{run_id}/{file_name}")
-            if previous_data is not None and previous_data.equals(data):
-                print(
-                    f"File '{file_name}' is identical to the previous file. Skipping SQL write."
-                )
-            else:
-                data['Period'] = data['Period'].apply(lambda s: str(s).lstrip('01/'))
-                data['Period'] = pd.to_datetime(data['Period'])
-                data['Period'] = data['Period'].dt.strftime('%d-%m-%Y')
-                with connection() as conn:
-                    data.to_sql(
-                        name="Metrics_Generic",
-                        con=conn,
-                        schema="staging",
-                        if_exists="replace",
-                        index=False,
-                    )
-                data_changed=True
-                merge_query ="""
-                set dateformat DMY 
-                MERGE INTO [scd].[Metric] AS target
-USING (
-    SELECT measure_id,
-        measure_description ,
-        cast([Period] as date) as Period ,
-        [Specialty/Trust],
-        [Numerator],
-        [Denominator],
-        [SourceFile]
-   FROM  [staging].[Metrics_Generic] b 
-   INNER JOIN scd.measure m 
-   ON m.measure_description = b.[metric name]
-   WHERE numerator IS NOT NULL
-) AS source
-ON target.measure_id = source.measure_id
-    AND CAST(target.[Period] AS DATE) = CAST(source.[Period] AS DATE)
-   AND target.dim1 = source.[Specialty/Trust]
-WHEN MATCHED AND (source.Numerator <> target.Numerator
-OR source.denominator <> target.denominator )
-THEN
-    UPDATE SET
-        target.[Numerator] = source.[Numerator],
-        target.[Denominator] = source.[Denominator],
-        target.[UpdatedBy] = source.[Sourcefile],
-        target.[UpdateDTTM] = GETDATE(),
-        target.UpdateType = 'Updated'
-WHEN NOT MATCHED BY TARGET THEN
-    INSERT (
-        [Measure_ID]
-        ,[Period]
-        ,DIM1
-        ,[Numerator]
-        ,[Denominator]
-        ,[UpdatedBy]
-        ,[UpdateDTTM]
-        ,[UpdateType]
+            for fileshare_path in fileshare_paths
+        ]
+        for archive in archives:
+            archive.result()
+
+
+def prepare_generic_metrics(data: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """
+    Validates the headers of a generic metrics file and normalises its columns.
+
+    Args:
+        data (pd.DataFrame): The parsed file.
+
+    Returns:
+        Optional[pd.DataFrame]: The normalised data, or None if the headers do not match.
+    """
+    required_columns = {'Metric Name', 'Period', 'Specialty/Trust', 'Numerator', 'Denominator'}
+    if not required_columns.issubset(set(data.columns)):
+        print("Data does not match the headers, skipping")
+        return None
+    # The header check guarantees the names, so only reorder (or drop extra columns) when needed
+    if list(data.columns) != GENERIC_METRIC_COLUMNS:
+        data = data.reindex(columns=GENERIC_METRIC_COLUMNS)
+    assert "Metric Name" in data.columns, "Metric name col is missing"
+    return data
+
+
+def combine_generic_metrics(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keeps the newest row with a Numerator for each metric, period and specialty/trust.
+
+    Rows without a Numerator are never merged, so they are dropped before staging
+    rather than sent to SQL Server and filtered there. They are dropped before
+    deduplicating so they cannot hide an older row with a value. Files are
+    concatenated oldest first, so the newest file wins on overlapping keys. Only
+    that row reaches the merge, which compares it with the target once rather than
+    once per file, so where a file's Denominator is NULL the merge's <> test can
+    update a row that merging the files in turn would have left alone, or the
+    reverse. Rows with a NULL key never match, so they are passed through
+    undeduplicated and each is still inserted.
+
+    Args:
+        data (pd.DataFrame): The concatenated files of a run.
+
+    Returns:
+        pd.DataFrame: One row per merge key, plus every row with a NULL key.
+    """
+    data = data[data["Numerator"].notna()]
+    keys = list(GENERIC_MERGE_KEYS)
+    has_null_key = data[keys].isna().any(axis=1)
+    combined = data[~has_null_key].drop_duplicates(subset=keys, keep="last")
+    return pd.concat([combined, data[has_null_key]], ignore_index=True)
+
+
+def combine_elective_recovery(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keeps the newest non-null value of each column for every elective recovery key.
+
+    This mirrors the elective recovery merge, which keeps the target's value wherever
+    the source is null, but it is not identical to merging each file in turn. The merge
+    only updates a matched row when a value differs, and a comparison with NULL is never
+    true, so a file whose differing value is NULL on either side leaves the row as it was.
+    A combined row is compared once, so it can fill in a target value that the files
+    merged one by one would have left NULL. Rows with a NULL key never match, so they are
+    passed through ungrouped and each is still inserted.
+
+    Args:
+        data (pd.DataFrame): The concatenated files of a run.
+
+    Returns:
+        pd.DataFrame: One row per merge key, plus every row with a NULL key.
+    """
+    keys = list(ELECTIVE_RECOVERY_MERGE_KEYS)
+    has_null_key = data[keys].isna().any(axis=1)
+    combined = (
+        data[~has_null_key]
+        .groupby(keys, sort=False, as_index=False)
+        .last()
     )
-    VALUES (
-        source.[Measure_id],
-        cast(source.[Period] as date) , 
-        source.[Specialty/Trust],
-        source.[Numerator],
-        source.[Denominator],
-        source.[Sourcefile],
-        GETDATE(),
-        'Inserted'
-    );
-                """
-                execute_query(merge_query)
-                log_file(file_name=file_name, source="SFTP")
-                previous_data = data
-    else:
-        print("No files,skipping...")
+    return pd.concat([combined, data[has_null_key]], ignore_index=True).reindex(
+        columns=data.columns
+    )
+
+
+def load_generic_metrics(data: pd.DataFrame) -> None:
+    """
+    Stages a run's generic metrics and merges them into scd.Metric.
+
+    Args:
+        data (pd.DataFrame): The concatenated files of a run.
+
+    Returns:
+        None
+    """
+    load_staging(
+        combine_generic_metrics(data),
+        name="Metrics_Generic",
+        dtype=GENERIC_STAGING_DTYPES,
+    )
+    merge_data(source="staging.Metrics_Generic", target="scd.Metric")
+
+
+def load_elective_recovery(data: pd.DataFrame) -> None:
+    """
+    Stages a run's elective recovery data and merges it into scd.Metrics_ElectiveRecovery.
+
+    Args:
+        data (pd.DataFrame): The concatenated files of a run.
+
+    Returns:
+        None
+    """
+    load_staging(
+        combine_elective_recovery(data),
+        name="Metrics_ElectiveRecovery",
+        dtype=ELECTIVE_RECOVERY_STAGING_DTYPES,
+    )
+    merge_elective_recovery_data(
+        source="staging.Metrics_ElectiveRecovery",
+        target="scd.Metrics_ElectiveRecovery",
+    )
+
 
+def load_and_merge(spec: PipelineSpec, frames: List[pd.DataFrame]) -> None:
+    """
+    Concatenates the given frames and loads them through the pipeline.
 
-    files = list_files_in_fileshare(fileshare_name="qvh", directory_path="Uploads/IQPR/ElectiveRecovery")
-    files=filter_files(files=files)
+    All files of a run are staged together so the target is merged once rather than once per file.
+
+    Args:
+        spec (PipelineSpec): The pipeline the data belongs to.
+        frames (List[pd.DataFrame]): The data to load, in the order the files were listed.
+
+    Returns:
+        None
+    """
+    data = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    spec.load(data)
+
+
+def run_pipeline(spec: PipelineSpec, executor: Executor) -> bool:
+    """
+    Lists, downloads, processes, merges, archives and logs the new files of one source.
+
+    Downloads run ahead of processing on the executor; files are still processed oldest
+    first. A file identical to the previously accepted one is skipped before parsing.
+    Nothing is archived or logged until the merge has succeeded, so a failure at any
+    point leaves every file of the run where it was. Files whose data was merged, and
+    duplicates of them, are archived; files rejected by the prepare step stay in place.
+
+    Args:
+        spec (PipelineSpec): The pipeline to run.
+        executor (Executor): Executor used for downloads.
+
+    Returns:
+        bool: True if any data was merged.
+    """
+    files = spec.list_files()
     print(files)
-    if files != []:
-        previous_data = None
-        run_id = generate_id()
-        make_dir(run_id)
-        for file in files:
-            print(f"Processing {file}")
-            file_name = file.split("/")[-1]
-            download_from_fileshare(
-                fileshare_name="qvh",
-                fileshare_path=f"Uploads/IQPR/ElectiveRecovery/{file}",
-                local_file_path=f"./{run_id}/{file_name}",
-            )
-            archive_in_fileshare(
-                fileshare_name="qvh",
-                source_path=f"Uploads/IQPR/ElectiveRecovery/{file}",
-                destination_path=f"Uploads/IQPR/Processed",
-            )
-            data = process_file(f"./{run_id}/{file_name}")
-            if previous_data is not None and previous_data.equals(data):
-                print(
-                    f"File '{file_name}' is identical to the previous file. Skipping SQL write."
-                )
-            else:
-                data['Period'] = data['Period'].apply(lambda s: str(s).lstrip('01/'))
-                data['Period'] = pd.to_datetime(data['Period'])
-                data['Period'] = data['Period'].dt.strftime('%d-%m-%Y')
-                with connection() as conn:
-                    data.to_sql(
-                        name="Metrics_ElectiveRecovery",
-                        con=conn,
-                        schema="staging",
-                        if_exists="replace",
-                        index=False,
+    if files == []:
+        print(f"No new files in {spec.name}, skipping...")
+        return False
+
+    previous_hash = None
+    frames = []
+    merged_files = []
+    # Merged files plus later copies of them, whose content is covered by the merge
+    archived_files = []
+    # closing() runs prefetch's cleanup as soon as the loop exits, even on an error,
+    # so downloaded files that were never consumed are closed
+    with closing(
+        prefetch(executor, spec.fetch, files, PREFETCH_WINDOW, release=close_fetched)
+    ) as fetched:
+        for file, (content_hash, buffer) in fetched:
+            with buffer:
+                print(f"Processing {file}")
+                file_name = file.split("/")[-1]
+                # Compare fingerprints before parsing so identical files are never read
+                if content_hash == previous_hash:
+                    print(
+                        f"File '{file_name}' is identical to the previous file. Skipping SQL write."
                     )
-                data_changed=True
-                merge_query ="""MERGE INTO [scd].[Metrics_ElectiveRecovery] AS target
-USING [staging].[Metrics_ElectiveRecovery] AS source
-    ON (
-            target.[ElectiveRecoveryGroup] = source.[ElectiveRecoveryGroup]
-            AND target.[ReportingPODDescription] = source.[ReportingPODDescription]
-            AND target.[OPS] = source.[OPS]
-            AND target.[SpecialtyDescription] = source.[SpecialtyDescription]
-            AND target.[OnSite] = source.[OnSite]
-            AND target.[Month] = source.[Month]
-            AND target.[Fyear] = (
-                SELECT fiscalyear
-                FROM scd.PeriodTable
-                WHERE enddate = eomonth(dateadd(month, - 1, getdate()))
-                )
-            )
-WHEN MATCHED
-    AND target.[Plan] <> source.[Plan]
-    OR target.Activity <> source.Activity
-    OR target.Variance <> source.Variance
-    THEN
-        UPDATE
-        SET target.[Plan] = CASE 
-                WHEN source.[Plan] IS NOT NULL
-                    THEN source.[Plan]
-                ELSE target.[Plan]
-                END
-            , target.[Activity] = CASE 
-                WHEN source.[Activity] IS NOT NULL
-                    THEN source.[Activity]
-                ELSE target.[Activity]
-                END
-            , target.[Variance] = CASE 
-                WHEN source.[Variance] IS NOT NULL
-                    THEN source.[Variance]
-                ELSE target.[Variance]
-                END
-            , target.[SourceFile] = source.[SourceFile]
-            , target.[FYear] = (
-                SELECT fiscalyear
-                FROM scd.PeriodTable
-                WHERE enddate = eomonth(dateadd(month, - 1, getdate()))
-                )
-WHEN NOT MATCHED BY TARGET
-    THEN
-        INSERT (
-            [ElectiveRecoveryGroup]
-            , [ReportingPODDescription]
-            , [OPS]
-            , [SpecialtyDescription]
-            , [OnSite]
-            , [Month]
-            , [Plan]
-            , [Activity]
-            , [Variance]
-            , [SourceFile]
-            , [FYear]
-            )
-        VALUES (
-            source.[ElectiveRecoveryGroup]
-            , source.[ReportingPODDescription]
-            , source.[OPS]
-            , source.[SpecialtyDescription]
-            , source.[OnSite]
-            , source.[Month]
-            , source.[Plan]
-            , source.[Activity]
-            , source.[Variance]
-            , source.[SourceFile]
-            , (
-                SELECT fiscalyear
-                FROM scd.PeriodTable
-                WHERE enddate = eomonth(dateadd(month, - 1, getdate()))
-                )
-            )
-                """
-                execute_query(merge_query)
-                log_file(file_name=file_name, source="FileShare")
-                previous_data = data
-    else:
-        print("No files,skipping...")
+                    archived_files.append(file)
+                    continue
+                data = process_file_from_buffer(buffer, file_name)
+            if spec.prepare is not None:
+                data = spec.prepare(data)
+                if data is None:
+                    continue
+            previous_hash = content_hash
+            frames.append(data)
+            merged_files.append(file)
+            archived_files.append(file)
 
-if data_changed is True:
-    query = """update scd.RefreshTimes
+    if frames:
+        load_and_merge(spec, frames)
+    if merged_files:
+        if spec.archive is not None:
+            spec.archive(archived_files)
+        log_files(
+            file_names=[file.split("/")[-1] for file in merged_files],
+            source=spec.source,
+        )
+    return bool(merged_files)
+
+
+if __name__ == "__main__":
+    client_id = os.environ["AZURE_CLIENT_ID"]
+    client_secret = os.environ["AZURE_CLIENT_SECRET"]
+    tenant_id = os.environ["AZURE_TENANT_ID"]
+    download_dir = make_temp_dir()
+    pipelines = [
+        PipelineSpec(
+            name="qvh blob container",
+            source="SFTP",
+            list_files=list_blob_uploads,
+            fetch=fetch_from_blob,
+            prepare=prepare_generic_metrics,
+            load=load_generic_metrics,
+            archive=archive_blobs,
+        ),
+        PipelineSpec(
+            name="Uploads/IQPR",
+            source="SFTP",
+            list_files=lambda: list_fileshare_uploads()["Uploads/IQPR"],
+            fetch=lambda fileshare_path: fetch_from_fileshare(
+                fileshare_path, download_dir
+            ),
+            prepare=prepare_generic_metrics,
+            load=load_generic_metrics,
+            archive=archive_fileshare_files,
+        ),
+        PipelineSpec(
+            name="Uploads/IQPR/ElectiveRecovery",
+            source="FileShare",
+            list_files=lambda: list_fileshare_uploads()["Uploads/IQPR/ElectiveRecovery"],
+            fetch=lambda fileshare_path: fetch_from_fileshare(
+                fileshare_path, download_dir
+            ),
+            load=load_elective_recovery,
+            archive=archive_fileshare_files,
+        ),
+    ]
+
+    data_changed = False
+    with ThreadPoolExecutor(max_workers=MAX_TRANSFER_WORKERS) as download_executor:
+        for pipeline in pipelines:
+            # Evaluate every pipeline, even once data has changed
+            data_changed = run_pipeline(pipeline, download_executor) or data_changed
+
+    if data_changed is True:
+        # Record the refresh and recalculate the measures on one connection and transaction
+        execute_queries(
+            [
+                (
+                    """update scd.RefreshTimes
 set UpdateDTTM = getdate()
-where Feed = 'Data'"""
-    execute_query(query)
-    stored_proc="exec scd.UpdateCalculatedMeasures"
-    execute_query(stored_proc)
-else:
-    raise ValueError("No new data found")
+where Feed = :feed""",
+                    {"feed": "Data"},
+                ),
+                ("exec scd.UpdateCalculatedMeasures", None),
+            ]
+        )
+    else:
+        raise ValueError("No new data found")
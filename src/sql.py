@@ -4,40 +4,82 @@ and executing SQL queries to return the results as a Pandas DataFrame. It uses c
 for managing the database connection and dotenv for loading environment variables.
 
 Functions:
-- connection: A context manager for creating and closing the database connection.
+- connection: A context manager providing the shared database engine, created once per run.
 - read_sql: Executes a SQL query and returns the result as a Pandas DataFrame.
-- execute_query: Executes a SQL command (INSERT, UPDATE, DELETE, MERGE) and commits the transaction.
+- execute_query: Executes a parameterised SQL command (INSERT, UPDATE, DELETE, MERGE) and commits the transaction.
+- execute_queries: Executes several SQL commands on one connection in a single transaction.
+- load_staging: Replaces the contents of a staging table with a DataFrame using batched inserts.
+- get_logged_files: Returns when each file recorded in the file log for a source was last logged.
+- log_files: Logs several file entries in a single statement and transaction.
+- merge_elective_recovery_data: Merges staged elective recovery data into its target table.
 """
 
+import atexit
 from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
 import urllib
-from typing import Iterator, Literal
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.engine import Engine
+from sqlalchemy.types import Date, TypeEngine
 from utils import get_credential  # pylint: disable=import-error
 
+# Bound parameters for one execution, or a list of them for an executemany
+QueryParams = Union[Dict[str, Any], List[Dict[str, Any]]]
+
+
+@lru_cache(maxsize=1)
+def _get_engine() -> Engine:
+    """
+    Creates the SQLAlchemy engine once per process.
+
+    The connection string is read from KeyVault and the engine is built on first use;
+    later calls reuse the engine and its connection pool, so each operation only checks
+    out a pooled connection instead of repeating the KeyVault lookup and engine setup.
+    pyodbc's fast_executemany is enabled so bulk inserts are sent as parameter arrays
+    instead of one round-trip per row.
+
+    Returns:
+        Engine: The shared SQLAlchemy Engine.
+    """
+    connstr = get_credential("public-dataflow-connectionstring")
+    params = urllib.parse.quote_plus(connstr)
+    engine = create_engine(
+        f"mssql+pyodbc:///?odbc_connect={params}",
+        fast_executemany=True,
+        pool_pre_ping=True,
+        pool_size=8,
+    )
+    # Close the pooled connections when the process exits
+    atexit.register(engine.dispose)
+    return engine
+
 
 @contextmanager
 def connection() -> Iterator[Engine]:
     """
-    Context manager to create and close a database connection.
+    Context manager that provides the shared database engine.
 
-    Loads database connection parameters from environment variables, creates
-    a SQLAlchemy engine, and yields the engine. The engine is closed when the
-    context is exited.
+    The engine is created on first use and reused for the rest of the run; its pooled
+    connections are closed at exit rather than when the context is exited.
 
     Returns:
         Iterator[Engine]: An iterator that yields a SQLAlchemy Engine.
     """
-
-    connstr = get_credential("public-dataflow-connectionstring")
-    params = urllib.parse.quote_plus(connstr)
-    engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-    try:
-        yield engine
-    finally:
-        engine.dispose()
+    yield _get_engine()
 
 
 def read_sql(query: str) -> pd.DataFrame:
@@ -54,25 +96,127 @@ def read_sql(query: str) -> pd.DataFrame:
         return pd.read_sql(sql=query, con=conn)
 
 
-def execute_query(query: str) -> None:
+def execute_query(query: str, params: Optional[QueryParams] = None) -> None:
     """
     Executes a SQL command (INSERT, UPDATE, DELETE, MERGE) and commits the transaction.
 
+    Values should be passed as bound parameters (":name" in the query) rather than
+    formatted into the SQL, so the statement text stays the same between calls and
+    SQL Server can reuse its cached plan. A list of parameter sets runs the command
+    once per set as a single executemany.
+
     Args:
         query (str): The SQL command to execute.
+        params (Dict[str, Any] | List[Dict[str, Any]], optional): Values for the query's bound parameters.
+
+    Returns:
+        None
+    """
+    execute_queries([(query, params)])
+
+
+def execute_queries(queries: List[Tuple[str, Optional[QueryParams]]]) -> None:
+    """
+    Executes several SQL commands in order on one connection and commits them as one transaction.
+
+    Each command is executed on its own rather than joined into a single batch: pyodbc
+    only raises an error from a later statement of a batch when its result sets are
+    walked, so a failure after the first statement would otherwise go unnoticed.
+
+    Args:
+        queries (List[Tuple[str, Optional[QueryParams]]]): Pairs of SQL command and its bound parameters.
 
     Returns:
         None
     """
     with connection() as conn:
-        conn_ = conn.connect()
-        with conn_.begin() as transaction:
-            try:
-                conn_.execute(text(query))
-                transaction.commit()
-            except Exception as e:
-                transaction.rollback()
-                raise e
+        with conn.connect() as conn_:
+            with conn_.begin() as transaction:
+                try:
+                    for query, params in queries:
+                        conn_.execute(text(query), params)
+                    transaction.commit()
+                except Exception as e:
+                    transaction.rollback()
+                    raise e
+
+
+def _matches_staging_table(
+    columns: Sequence[Mapping[str, Any]],
+    data: pd.DataFrame,
+    dtype: Mapping[str, TypeEngine],
+) -> bool:
+    """
+    Checks whether an existing staging table can take the given data as it is.
+
+    Args:
+        columns (Sequence[Mapping[str, Any]]): The table's columns, as reflected by the inspector.
+        data (pd.DataFrame): The data to load.
+        dtype (Mapping[str, TypeEngine]): Types the data's columns must have in the table.
+
+    Returns:
+        bool: True if the table has exactly the data's columns and the required types.
+    """
+    existing = {column["name"]: column["type"] for column in columns}
+    if set(existing) != set(data.columns):
+        return False
+    return all(
+        isinstance(existing[column], type(column_type))
+        for column, column_type in dtype.items()
+    )
+
+
+def load_staging(
+    data: pd.DataFrame,
+    name: str,
+    schema: str = "staging",
+    chunksize: int = 10000,
+    dtype: Optional[Mapping[str, TypeEngine]] = None,
+) -> None:
+    """
+    Replaces the contents of a staging table with the given DataFrame.
+
+    The table is truncated and appended to in a single transaction rather than
+    dropped and recreated on every load. It is only (re)created by pandas when it
+    does not exist yet, or when its columns or the types required by dtype no
+    longer match the data; datetime columns are always created as DATE.
+
+    Args:
+        data (pd.DataFrame): The data to load.
+        name (str): The name of the staging table.
+        schema (str): The schema of the staging table. Defaults to "staging".
+        chunksize (int): Number of rows sent per batch. Defaults to 10000.
+        dtype (Mapping[str, TypeEngine], optional): SQL types for specific columns.
+
+    Returns:
+        None
+    """
+    column_types: Dict[str, TypeEngine] = {
+        column: Date()
+        for column in data.columns
+        if pd.api.types.is_datetime64_any_dtype(data[column])
+    }
+    column_types.update(dtype or {})
+    with connection() as conn:
+        with conn.begin() as conn_:
+            inspector = inspect(conn_)
+            if inspector.has_table(name, schema=schema):
+                if _matches_staging_table(
+                    inspector.get_columns(name, schema=schema), data, column_types
+                ):
+                    conn_.execute(text(f"TRUNCATE TABLE [{schema}].[{name}]"))
+                else:
+                    print(f"Recreating [{schema}].[{name}] to match the data's columns")
+                    conn_.execute(text(f"DROP TABLE [{schema}].[{name}]"))
+            data.to_sql(
+                name=name,
+                con=conn_,
+                schema=schema,
+                if_exists="append",
+                index=False,
+                chunksize=chunksize,
+                dtype=column_types,
+            )
 
 
 def merge_data(source: str, target: str) -> None:
@@ -84,7 +228,8 @@ def merge_data(source: str, target: str) -> None:
     criteria, or insert new records if they do not already exist. The merge operation considers the
     measure_id, period, and specialty/trust columns to match existing records. If a match is found and
     the numerator or denominator values differ, it updates the records. If no match is found, it inserts
-    the new records.
+    the new records. The target is locked with TABLOCK for the duration of the merge so a bulk merge
+    takes one table lock instead of escalating through row and page locks.
 
     Args:
     - source (str): The name of the source table containing the data to merge.
@@ -93,8 +238,7 @@ def merge_data(source: str, target: str) -> None:
     Returns:
     - None
     """
-    query = f"""SET DATEFORMAT DMY
-MERGE INTO {target} AS target
+    query = f"""MERGE INTO {target} WITH (TABLOCK) AS target
 USING (
     SELECT measure_id,
         measure_description ,
@@ -141,9 +285,103 @@ WHEN NOT MATCHED BY TARGET THEN
     execute_query(query)
 
 
+def merge_elective_recovery_data(source: str, target: str) -> None:
+    """
+    Merges elective recovery data from the specified source table into the target table.
+
+    Records are matched on elective recovery group, reporting POD, OPS, specialty, site and month
+    within the current fiscal year (the one ending last month). Matched records whose plan, activity
+    or variance differ are updated, keeping existing values where the source is NULL, and unmatched
+    records are inserted against the current fiscal year.
+
+    Args:
+    - source (str): The name of the source table containing the data to merge.
+    - target (str): The name of the target table where data is merged.
+
+    Returns:
+    - None
+    """
+    query = f"""MERGE INTO {target} WITH (TABLOCK) AS target
+USING {source} AS source
+    ON (
+            target.[ElectiveRecoveryGroup] = source.[ElectiveRecoveryGroup]
+            AND target.[ReportingPODDescription] = source.[ReportingPODDescription]
+            AND target.[OPS] = source.[OPS]
+            AND target.[SpecialtyDescription] = source.[SpecialtyDescription]
+            AND target.[OnSite] = source.[OnSite]
+            AND target.[Month] = source.[Month]
+            AND target.[Fyear] = (
+                SELECT fiscalyear
+                FROM scd.PeriodTable
+                WHERE enddate = eomonth(dateadd(month, - 1, getdate()))
+                )
+            )
+WHEN MATCHED
+    AND target.[Plan] <> source.[Plan]
+    OR target.Activity <> source.Activity
+    OR target.Variance <> source.Variance
+    THEN
+        UPDATE
+        SET target.[Plan] = CASE 
+                WHEN source.[Plan] IS NOT NULL
+                    THEN source.[Plan]
+                ELSE target.[Plan]
+                END
+            , target.[Activity] = CASE 
+                WHEN source.[Activity] IS NOT NULL
+                    THEN source.[Activity]
+                ELSE target.[Activity]
+                END
+            , target.[Variance] = CASE 
+                WHEN source.[Variance] IS NOT NULL
+                    THEN source.[Variance]
+                ELSE target.[Variance]
+                END
+            , target.[SourceFile] = source.[SourceFile]
+            , target.[FYear] = (
+                SELECT fiscalyear
+                FROM scd.PeriodTable
+                WHERE enddate = eomonth(dateadd(month, - 1, getdate()))
+                )
+WHEN NOT MATCHED BY TARGET
+    THEN
+        INSERT (
+            [ElectiveRecoveryGroup]
+            , [ReportingPODDescription]
+            , [OPS]
+            , [SpecialtyDescription]
+            , [OnSite]
+            , [Month]
+            , [Plan]
+            , [Activity]
+            , [Variance]
+            , [SourceFile]
+            , [FYear]
+            )
+        VALUES (
+            source.[ElectiveRecoveryGroup]
+            , source.[ReportingPODDescription]
+            , source.[OPS]
+            , source.[SpecialtyDescription]
+            , source.[OnSite]
+            , source.[Month]
+            , source.[Plan]
+            , source.[Activity]
+            , source.[Variance]
+            , source.[SourceFile]
+            , (
+                SELECT fiscalyear
+                FROM scd.PeriodTable
+                WHERE enddate = eomonth(dateadd(month, - 1, getdate()))
+                )
+            );"""
+    execute_query(query)
+
+
 def log_file(file_name: str, source: Literal["SFTP", "FileShare"]) -> None:
     """
     Logs a file entry into the scd.MetricFileLog table.
+    Prefer log_files to record several files in one round-trip.
 
     Args:
         file_name (str): The name of the file.
@@ -152,8 +390,60 @@ def log_file(file_name: str, source: Literal["SFTP", "FileShare"]) -> None:
     Returns:
         None
     """
-    query = f"""
-        INSERT INTO scd.MetricFileLog (FileName, Source, DateUploaded)
-        VALUES ('{file_name}','{source}', GETDATE())
-        """
-    execute_query(query=query)
+    log_files(file_names=[file_name], source=source)
+
+
+def log_files(file_names: List[str], source: Literal["SFTP", "FileShare"]) -> None:
+    """
+    Logs several file entries into the scd.MetricFileLog table at once.
+
+    The rows are sent as one parameterised executemany (a single round-trip with
+    fast_executemany) and committed in a single transaction.
+
+    Args:
+        file_names (List[str]): The names of the files.
+        source (str): The source of the files.
+
+    Returns:
+        None
+    """
+    if not file_names:
+        return
+    execute_query(
+        """INSERT INTO scd.MetricFileLog (FileName, Source, DateUploaded)
+        VALUES (:file_name, :source, GETDATE())""",
+        params=[{"file_name": file_name, "source": source} for file_name in file_names],
+    )
+
+
+def get_logged_files(source: Literal["SFTP", "FileShare"]) -> Dict[str, datetime]:
+    """
+    Returns when each file recorded in the scd.MetricFileLog table for a source was last logged.
+
+    DateUploaded holds the server's local time (GETDATE()), so it is shifted by the
+    server's current UTC offset to be comparable with storage timestamps; entries from
+    the other side of a daylight saving change are off by that hour.
+
+    Args:
+        source (str): The source of the files.
+
+    Returns:
+        Dict[str, datetime]: The latest log time in UTC, keyed by file name.
+    """
+    with connection() as conn:
+        with conn.connect() as conn_:
+            result = conn_.execute(
+                text(
+                    """SELECT FileName,
+                    DATEADD(MINUTE, -DATEPART(TZOFFSET, SYSDATETIMEOFFSET()), MAX(DateUploaded))
+                    FROM scd.MetricFileLog
+                    WHERE Source = :source
+                    GROUP BY FileName"""
+                ),
+                {"source": source},
+            )
+            return {
+                file_name: logged_at.replace(tzinfo=timezone.utc)
+                for file_name, logged_at in result
+                if logged_at is not None
+            }
@@ -6,25 +6,89 @@ creating directories, generating random IDs, processing files, and filtering fil
 
 Functions:
     - get_credential(name: str) -> str: Retrieves a credential value from Azure KeyVault.
+    - make_storage_transport() -> RequestsTransport: Creates an HTTP transport whose connection pool fits every concurrent transfer.
+    - make_read_sas_url(url: str, generate_sas: Callable[..., str], **sas_args: Any) -> str: Appends a short-lived read SAS token to a storage URL.
     - make_dir(directory_path: str) -> None: Creates a directory if it doesn't already exist.
+    - make_temp_dir() -> str: Creates a temporary download directory that is removed at exit.
     - generate_id(length: int = 8) -> str: Generates a random ID of the specified length.
     - process_file(file_path: str) -> pd.DataFrame: Processes a file and returns a pandas DataFrame.
-    - filter_files(files: List[str]) -> List[str]: Filters a list of filenames based on allowed extensions.
+    - process_file_from_buffer(buffer: BinaryIO, file_name: str) -> pd.DataFrame: Processes an in-memory file, parsing any Period column, and returns a pandas DataFrame.
+    - filter_files(files: List[str], exclude: Optional[str] = None) -> List[str]: Filters a list of filenames based on allowed extensions.
+    - parse_period(period: pd.Series) -> pd.Series: Parses a Period column to datetime64.
+    - wait_for_copy(get_status: Callable[[], str]) -> str: Polls a server-side copy with exponential backoff until it leaves the pending state.
+    - prefetch(executor: Executor, func: Callable[[T], R], items: List[T], window: int, release: Optional[Callable[[R], None]] = None) -> Generator[Tuple[T, R], None, None]: Runs func on a bounded window of items ahead of the consumer.
+    - new_content_hash() -> Any: Returns a streaming hash object used to fingerprint file content.
+    - hash_content(content: bytes) -> str: Returns the hex digest of a file's content.
+    - hash_file(file_path: str) -> str: Returns the hex digest of a local file's content.
+    - is_same_content(source: Any, destination: Optional[Any]) -> bool: Checks whether two storage files have matching size and MD5.
 """
 
+import atexit
 import os
-from typing import List
-import string
-import random
+import secrets
+import shutil
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import Executor, Future
+from functools import lru_cache, partial
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Deque,
+    Generator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 import pandas as pd
+import pyarrow as pa
+import requests
+import xxhash
+from pyarrow import csv as pacsv
+from python_calamine import CalamineError
+from requests.adapters import HTTPAdapter
+from azure.core.pipeline.transport import RequestsTransport
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
 from exc import KeyVaultError, DataFileError  # pylint: disable=import-error
 
+T = TypeVar("T")
+R = TypeVar("R")
 
+# File extensions accepted by filter_files
+ALLOWED_EXTENSIONS = frozenset({".csv", ".xls", ".xlsx"})
+
+# Block size used by the multi-threaded Arrow CSV reader
+CSV_BLOCK_SIZE = 8 << 20
+
+# Files transferred at once, and parallel range requests within each download
+# or chunked copy; storage connection pools are sized for all of them together
+MAX_TRANSFER_WORKERS = 8
+DOWNLOAD_MAX_CONCURRENCY = 4
+COPY_MAX_CONCURRENCY = 4
+TRANSFER_POOL_SIZE = MAX_TRANSFER_WORKERS * max(DOWNLOAD_MAX_CONCURRENCY, COPY_MAX_CONCURRENCY)
+
+# Blobs and files above this size are archived by copying 4 MiB chunks from a
+# SAS URL in parallel: 256 MiB is the limit for a synchronous Copy Blob From URL,
+# and 4 MiB the most one Put Range From URL call accepts (Put Block From URL takes
+# far larger blocks, but blobs use the same chunk size to keep each request short)
+URL_COPY_THRESHOLD = 256 * 1024 * 1024
+URL_COPY_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Backoff bounds (seconds) used while polling server-side copy operations
+COPY_POLL_INITIAL_DELAY = 0.1
+COPY_POLL_MAX_DELAY = 5.0
+
+
+@lru_cache(maxsize=None)
 def get_credential(name: str) -> str:
     """
-    Retrieves a credential value from Azure KeyVault
+    Retrieves a credential value from Azure KeyVault.
+    Values are cached for the lifetime of the process, so each secret is fetched once.
 
     Parameters:
     name (str): The name of the credential inside KeyVault
@@ -44,6 +108,45 @@ def get_credential(name: str) -> str:
     return credential_value
 
 
+def make_storage_transport() -> RequestsTransport:
+    """
+    Creates an HTTP transport for a storage client with a connection pool of TRANSFER_POOL_SIZE.
+
+    Storage clients are cached, so each keeps one transport and reuses its
+    connections instead of re-negotiating TLS per operation. The default pool
+    keeps 10 connections per host, fewer than the range requests issued by
+    MAX_TRANSFER_WORKERS concurrent transfers, so the excess connections would
+    be opened and discarded on every request.
+
+    Returns:
+        RequestsTransport: A transport to pass to a storage service client.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=TRANSFER_POOL_SIZE))
+    return RequestsTransport(session=session)
+
+
+def make_read_sas_url(url: str, generate_sas: Callable[..., str], **sas_args: Any) -> str:
+    """
+    Appends a read-only SAS token valid for one hour to a storage URL, as required
+    by the *From URL copy operations.
+
+    Args:
+        url (str): The URL of the blob or file.
+        generate_sas (Callable[..., str]): generate_blob_sas or generate_file_sas.
+        **sas_args (Any): The account, resource and key arguments for generate_sas.
+
+    Returns:
+        str: The URL including the SAS token.
+    """
+    sas_token = generate_sas(
+        permission="r",
+        expiry=datetime.now(timezone.utc) + timedelta(hours=1),
+        **sas_args,
+    )
+    return f"{url}?{sas_token}"
+
+
 def make_dir(directory_path):
     """
     Creates a directory if it doesn't already exist.
@@ -61,9 +164,26 @@ def make_dir(directory_path):
         print(f"Directory {directory_path} already exists.")
 
 
+def make_temp_dir() -> str:
+    """
+    Creates a temporary directory for downloaded files.
+
+    The directory is created in the system temp directory (TMPDIR), not RAM-backed
+    /dev/shm, which is only 64 MiB in a default Docker container. It is removed
+    when the process exits.
+
+    Returns:
+    - str: The path of the created directory.
+    """
+    directory_path = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, directory_path, ignore_errors=True)
+    print(f"Directory {directory_path} created.")
+    return directory_path
+
+
 def generate_id(length: int = 8) -> str:
     """
-    Generates a random ID of the specified length.
+    Generates a random, URL-safe ID of the specified length.
 
     Parameters:
     - length (int): The length of the random ID to generate. Default is 8.
@@ -71,9 +191,8 @@ def generate_id(length: int = 8) -> str:
     Returns:
     - str: The generated random ID.
     """
-    characters = string.ascii_letters + string.digits
-    random_id = "".join(random.choice(characters) for _ in range(length))
-    return random_id
+    # token_urlsafe yields ~1.3 characters per byte, so this is always long enough
+    return secrets.token_urlsafe(length)[:length]
 
 
 def process_file(file_path: str) -> pd.DataFrame:
@@ -90,28 +209,252 @@ def process_file(file_path: str) -> pd.DataFrame:
     Raises:
     - DataFileError: If the file format is unsupported (not .csv, .xls, or .xlsx).
     """
-    if file_path.endswith(".csv"):
-        data = pd.read_csv(file_path)
-    elif file_path.endswith(".xls") or file_path.endswith(".xlsx"):
-        data = pd.read_excel(file_path,engine='openpyxl')
+    with open(file_path, "rb") as file:
+        return process_file_from_buffer(file, file_path)
+
+
+def process_file_from_buffer(buffer: BinaryIO, file_name: str) -> pd.DataFrame:
+    """
+    Reads CSV, XLS, or XLSX content from a binary buffer and returns it as a Pandas DataFrame.
+    The format is taken from the extension of file_name, whose base name is added as the
+    'SourceFile' column. This lets downloaded files be parsed without a round-trip to disk.
+    CSV files are parsed by PyArrow's multi-threaded reader into Arrow-backed columns,
+    falling back to pd.read_csv when a column changes type after the first block;
+    Excel files are read with the Rust-backed calamine engine, falling back to openpyxl
+    if calamine is not available or reports the file as unreadable (CalamineError or
+    ValueError); a file neither engine can read raises openpyxl's error. A Period column is parsed to
+    datetimes as part of the read, so callers receive it ready to load.
+
+    Args:
+    - buffer (BinaryIO): A readable binary buffer holding the file content.
+    - file_name (str): The name or path of the file the content came from.
+
+    Returns:
+    - pd.DataFrame: DataFrame containing the data from the file.
+
+    Raises:
+    - DataFileError: If the file format is unsupported (not .csv, .xls, or .xlsx).
+    """
+    source_file = os.path.basename(file_name)
+    if file_name.endswith(".csv"):
+        try:
+            table = pacsv.read_csv(
+                buffer,
+                read_options=pacsv.ReadOptions(use_threads=True, block_size=CSV_BLOCK_SIZE),
+                # Empty text cells are null, as with pd.read_csv, rather than ''
+                convert_options=pacsv.ConvertOptions(strings_can_be_null=True),
+            )
+        # Arrow infers each column's type from the first block, so a later value
+        # of another type (decimals or text in an integer column) fails the read
+        except pa.ArrowInvalid:
+            buffer.seek(0)
+            data = pd.read_csv(buffer)
+            data["SourceFile"] = source_file
+        else:
+            data = table.to_pandas(types_mapper=pd.ArrowDtype)
+            # Keep the added column Arrow-backed too rather than object dtype
+            data["SourceFile"] = pd.Series(
+                source_file, index=data.index, dtype=pd.ArrowDtype(pa.string())
+            )
+    elif file_name.endswith(".xls") or file_name.endswith(".xlsx"):
+        try:
+            data = pd.read_excel(buffer, engine="calamine")
+        except (CalamineError, ImportError, ValueError):
+            buffer.seek(0)
+            data = pd.read_excel(buffer, engine="openpyxl")
+        data["SourceFile"] = source_file
     else:
         raise DataFileError(
-            f"{file_path} format is unsupported. Pass in a csv,xls or xlsx file."
+            f"{file_name} format is unsupported. Pass in a csv,xls or xlsx file."
         )
-    file_name = os.path.basename(file_path)
-    data["SourceFile"] = file_name
+    if "Period" in data.columns:
+        data["Period"] = parse_period(data["Period"])
     return data
 
 
-def filter_files(files: List[str]) -> List[str]:
+def parse_period(period: pd.Series) -> pd.Series:
+    """
+    Parses a Period column to datetimes using vectorised string and datetime operations.
+
+    A leading "01/" day is removed before parsing, so "01/10/2024" is read as October 2024.
+    The result is kept as datetime64 so it is sent to SQL Server as a typed date rather
+    than a string the server has to re-parse. Columns the reader already typed as dates
+    (Excel date cells, ISO 8601 CSV columns) skip the round-trip through strings.
+
+    Args:
+    - period (pd.Series): The raw Period column.
+
+    Returns:
+    - pd.Series: The Period column as datetime64.
+    """
+    if pd.api.types.is_datetime64_any_dtype(period):
+        return pd.to_datetime(period)
+    period = period.astype("string").str.removeprefix("01/")
+    # Periods repeat heavily within a file, so each distinct value is parsed once
+    return pd.to_datetime(period, cache=True)
+
+
+def filter_files(files: List[str], exclude: Optional[str] = None) -> List[str]:
     """
     Filters a list of filenames, returning only those that end with .csv, .xls, or .xlsx.
 
     Args:
         files (List[str]): List of filenames to filter.
+        exclude (str, optional): Drop filenames containing this substring in the same pass.
 
     Returns:
         List[str]: Filtered list of filenames.
     """
-    allowed_extensions = (".csv", ".xls", ".xlsx")
-    return [file for file in files if file.lower().endswith(allowed_extensions)]
+    return [
+        file
+        for file in files
+        if os.path.splitext(file)[1].lower() in ALLOWED_EXTENSIONS
+        and (exclude is None or exclude not in file)
+    ]
+
+
+def wait_for_copy(get_status: Callable[[], str]) -> str:
+    """
+    Polls the status of a server-side copy until it is no longer pending.
+
+    The delay between polls doubles from COPY_POLL_INITIAL_DELAY up to
+    COPY_POLL_MAX_DELAY, so short copies finish quickly without spinning on
+    the storage endpoint for long ones.
+
+    Args:
+        get_status (Callable[[], str]): Callable returning the current copy status.
+
+    Returns:
+        str: The final copy status (e.g. "success", "failed", "aborted").
+    """
+    attempt = 0
+    status = get_status()
+    while status == "pending":
+        time.sleep(min(COPY_POLL_INITIAL_DELAY * 2**attempt, COPY_POLL_MAX_DELAY))
+        attempt += 1
+        status = get_status()
+    return status
+
+
+def _release_result(release: Callable[[R], None], future: Future) -> None:
+    """
+    Passes the result of a completed future to release, unless the call failed.
+
+    Args:
+        release (Callable[[R], None]): Frees the resources held by a result.
+        future (Future): A future that has finished running.
+
+    Returns:
+        None
+    """
+    if future.exception() is None:
+        release(future.result())
+
+
+def prefetch(
+    executor: Executor,
+    func: Callable[[T], R],
+    items: List[T],
+    window: int,
+    release: Optional[Callable[[R], None]] = None,
+) -> Generator[Tuple[T, R], None, None]:
+    """
+    Runs func over items on an executor while yielding the results in the original order.
+
+    At most `window` calls are submitted ahead of the consumer, so I/O for upcoming
+    items overlaps with processing of the current one without every result being
+    held in memory at once. If the consumer stops early (it raises or breaks out),
+    calls that have not started yet are cancelled. Calls already running still
+    finish, so func should have no side effects beyond producing its result;
+    steps such as archiving belong after the consumer has handled the item.
+    Results that were produced but never consumed are passed to release, as
+    soon as their call finishes, so held resources such as open files are freed.
+
+    Args:
+        executor (Executor): The executor the calls are submitted to.
+        func (Callable[[T], R]): The function to call for each item.
+        items (List[T]): The items to process, in the order results are wanted.
+        window (int): The maximum number of calls in flight or awaiting consumption.
+        release (Callable[[R], None], optional): Frees an unconsumed result on early exit.
+
+    Returns:
+        Generator[Tuple[T, R], None, None]: Pairs of item and func(item), in the order of items.
+    """
+    pending: Deque[Tuple[T, Future]] = deque()
+    try:
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= window:
+                queued_item, future = pending.popleft()
+                yield queued_item, future.result()
+        while pending:
+            queued_item, future = pending.popleft()
+            yield queued_item, future.result()
+    finally:
+        for _, future in pending:
+            if not future.cancel() and release is not None:
+                future.add_done_callback(partial(_release_result, release))
+
+
+def new_content_hash() -> Any:
+    """
+    Returns a streaming xxh3_64 hash object for fingerprinting file content.
+
+    Returns:
+        Any: A hash object with update() and hexdigest() methods.
+    """
+    return xxhash.xxh3_64()
+
+
+def hash_content(content: bytes) -> str:
+    """
+    Returns the hex digest of a file's content.
+
+    Args:
+        content (bytes): The content to fingerprint.
+
+    Returns:
+        str: The hex digest of the content.
+    """
+    content_hash = new_content_hash()
+    content_hash.update(content)
+    return content_hash.hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Returns the hex digest of a local file's content, reading it in 1 MiB chunks.
+
+    Args:
+        file_path (str): The path of the file to fingerprint.
+
+    Returns:
+        str: The hex digest of the file content.
+    """
+    content_hash = new_content_hash()
+    with open(file_path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def is_same_content(source: Any, destination: Optional[Any]) -> bool:
+    """
+    Checks whether two blobs or files hold the same content according to their properties.
+
+    Archiving uses this to finish a move when a retry after a crash finds the
+    destination already written. Content is only considered the same when the
+    sizes match and both carry the same Content-MD5; without an MD5 on the
+    source the answer is always False.
+
+    Args:
+        source (Any): BlobProperties or FileProperties of the source.
+        destination (Any, optional): Properties of the destination, or None if it does not exist.
+
+    Returns:
+        bool: True if the destination already holds the source content.
+    """
+    if destination is None or source.size != destination.size:
+        return False
+    source_md5 = source.content_settings.content_md5
+    return source_md5 is not None and source_md5 == destination.content_settings.content_md5